@@ -1,13 +1,18 @@
 from __future__ import annotations
 
 import os
-from datetime import date, datetime, time, timedelta
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
 from zoneinfo import ZoneInfo
 
+import numpy as np
 import pandas as pd
 import streamlit as st
-import altair as alt
 import psycopg  # psycopg3
+from psycopg.rows import tuple_row
+from psycopg_pool import ConnectionPool
 
 DB_URL = st.secrets.get("DATABASE_URL") or os.getenv("DATABASE_URL")
 IS_PG = True
@@ -15,13 +20,70 @@ IS_PG = True
 # Use Eastern Time for 'today' calculations
 LOCAL_TZ = ZoneInfo("America/New_York")
 
+# Half-hour entry slots and their labels, built once rather than on every rerun.
+# Selectboxes use slot indices as options and look the label up by index.
+TIME_SLOTS: tuple[time, ...] = tuple(time(h, m) for h in range(24) for m in (0, 30))
+TIME_SLOTS_FMT: tuple[str, ...] = tuple(t.strftime("%I:%M %p") for t in TIME_SLOTS)
+TIMEFRAME_OPTIONS: tuple[str, ...] = ("Today", "Last 3 days", "Last 7 days", "Last 30 days", "Custom")
 
-def get_conn():
-    """Return a Postgres connection to Neon DB."""
+# Ranges longer than this are read through a server-side cursor, in chunks
+STREAM_ENTRIES_AFTER = timedelta(days=30)
+STREAM_CHUNK_ROWS = 5000
+
+# Bulk upserts smaller than this skip the COPY staging table
+BULK_COPY_MIN_ROWS = 1000
+
+
+@st.cache_resource
+def get_pool() -> ConnectionPool:
+    """Return a process-wide pool of Postgres connections to Neon DB."""
     if not DB_URL:
         st.error("`DATABASE_URL` is not set. Please configure your Neon DB URL.")
         st.stop()
-    return psycopg.connect(DB_URL)
+    # Every write in this app is a single statement, so autocommit keeps them
+    # atomic while sparing reads the BEGIN/COMMIT round trips.
+    return ConnectionPool(
+        DB_URL,
+        min_size=1,
+        max_size=4,
+        kwargs={"autocommit": True},
+        check=ConnectionPool.check_connection,
+        open=True,
+    )
+
+
+def local_datetime(day: date, at: time) -> datetime | None:
+    """`day` at wall-clock time `at` in LOCAL_TZ, or None if DST skips that time."""
+    when = datetime.combine(day, at, tzinfo=LOCAL_TZ)
+    # A time in the spring-forward gap doesn't survive a round trip through UTC;
+    # left alone it would alias the same instant an hour later.
+    if when.astimezone(timezone.utc).astimezone(LOCAL_TZ).replace(tzinfo=None) != when.replace(tzinfo=None):
+        return None
+    return when
+
+
+# Connection checked out by the outermost get_conn() block of the current run
+_run_conn: ContextVar[psycopg.Connection | None] = ContextVar("_run_conn", default=None)
+
+
+@contextmanager
+def get_conn():
+    """Borrow a warm connection from the pool for the duration of the block.
+
+    Nested blocks reuse the enclosing block's connection, so a full rerun checks
+    out (and health-checks) one connection even though its fragments ask for
+    their own; a fragment-only rerun checks out one for itself.
+    """
+    conn = _run_conn.get()
+    if conn is not None:
+        yield conn
+        return
+    with get_pool().connection() as conn:
+        token = _run_conn.set(conn)
+        try:
+            yield conn
+        finally:
+            _run_conn.reset(token)
 
 
 def Q(sql: str) -> str:
@@ -29,34 +91,107 @@ def Q(sql: str) -> str:
     return sql.replace("?", "%s")
 
 
+def client_execute(conn, sql: str, params: tuple | None = None) -> psycopg.ClientCursor:
+    """Run a short one-shot statement with client-side binding, as one simple query."""
+    return psycopg.ClientCursor(conn).execute(sql, params)
+
+
+# Hot statements, converted from '?' placeholders once at import. They run
+# with prepare=True, so each pooled connection parses and plans them only once.
+SQL_UPSERT_ENTRY = Q("""
+    INSERT INTO entries (baby_id, ts, milk, pee, poop)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(baby_id, ts) DO UPDATE SET
+        milk=excluded.milk,
+        pee=excluded.pee,
+        poop=excluded.poop;
+    """)
+
+SQL_DELETE_ENTRY = Q("DELETE FROM entries WHERE baby_id = ? AND ts = ?;")
+
+# Local wall-clock timestamps as epoch seconds: an int8 per row decodes to a
+# plain int rather than a datetime object, and pandas converts the whole
+# column at once. The three flags travel packed into one smallint bitmask
+# (bit 0 milk, bit 1 pee, bit 2 poop) and are unpacked with numpy.
+SQL_FETCH_ENTRIES = Q("""
+    SELECT EXTRACT(EPOCH FROM e.ts AT TIME ZONE ?::text)::bigint AS ts,
+           (e.milk | (e.pee << 1) | (e.poop << 2))::smallint AS flags
+    FROM entries e
+    WHERE e.baby_id = ? AND e.ts BETWEEN ? AND ?
+    ORDER BY e.ts ASC;
+    """)
+
+# Local midnight as a timestamp rather than a date, so pandas gets a
+# datetime64 column instead of one date object per day
+SQL_DAILY_COUNTS = Q("""
+    SELECT date_trunc('day', e.ts AT TIME ZONE ?::text) AS date,
+           SUM(e.milk) AS milk, SUM(e.pee) AS pee, SUM(e.poop) AS poop
+    FROM entries e
+    WHERE e.baby_id = ? AND e.ts BETWEEN ? AND ?
+    GROUP BY 1
+    ORDER BY 1;
+    """)
+
+
+@st.cache_resource
 def init_db() -> None:
+    """Create or migrate the schema; cached so it runs once per process."""
+    # Without parameters psycopg sends this as one simple-protocol query,
+    # so every statement below shares a single network round trip.
     with get_conn() as conn:
         conn.execute(
-            """
+            f"""
             CREATE TABLE IF NOT EXISTS babies (
                 id BIGSERIAL PRIMARY KEY,
                 name TEXT NOT NULL UNIQUE
             );
-            """
-        )
-        conn.execute(
-            """
             CREATE TABLE IF NOT EXISTS entries (
                 id BIGSERIAL PRIMARY KEY,
                 baby_id INTEGER NOT NULL REFERENCES babies(id) ON DELETE CASCADE,
-                ts TEXT NOT NULL,
+                ts TIMESTAMPTZ NOT NULL,
                 milk INTEGER NOT NULL DEFAULT 0,
                 pee  INTEGER NOT NULL DEFAULT 0,
                 poop INTEGER NOT NULL DEFAULT 0,
                 UNIQUE (baby_id, ts)
             );
-            """
-        )
-        # Ensure date of birth column exists
-        conn.execute("ALTER TABLE babies ADD COLUMN IF NOT EXISTS dob DATE")
-        # Create weights table for tracking baby weight over time
-        conn.execute(
-            """
+            -- Migrate legacy ISO-text timestamps (local wall-clock times) to TIMESTAMPTZ
+            DO $$
+            BEGIN
+                IF EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_schema = current_schema()
+                      AND table_name = 'entries'
+                      AND column_name = 'ts'
+                      AND data_type = 'text'
+                ) THEN
+                    -- Wall-clock times in the spring-forward gap (02:xx) resolve to
+                    -- the same instant as 03:xx, which would break UNIQUE (baby_id, ts).
+                    -- Merge each such pair into one row, OR-ing the flags, first.
+                    WITH conv AS (
+                        SELECT id, baby_id, ts::timestamp AT TIME ZONE '{LOCAL_TZ.key}' AS inst
+                        FROM entries
+                    ), dup AS (
+                        SELECT c.baby_id, c.inst, MIN(c.id) AS keep_id,
+                               MAX(e.milk) AS milk, MAX(e.pee) AS pee, MAX(e.poop) AS poop
+                        FROM conv c JOIN entries e ON e.id = c.id
+                        GROUP BY c.baby_id, c.inst
+                        HAVING COUNT(*) > 1
+                    ), merged AS (
+                        UPDATE entries e SET milk = d.milk, pee = d.pee, poop = d.poop
+                        FROM dup d
+                        WHERE e.id = d.keep_id
+                    )
+                    DELETE FROM entries e
+                    USING conv c, dup d
+                    WHERE e.id = c.id AND c.baby_id = d.baby_id AND c.inst = d.inst
+                      AND e.id <> d.keep_id;
+                    ALTER TABLE entries ALTER COLUMN ts TYPE TIMESTAMPTZ
+                        USING ts::timestamp AT TIME ZONE '{LOCAL_TZ.key}';
+                END IF;
+            END $$;
+            -- Ensure date of birth column exists
+            ALTER TABLE babies ADD COLUMN IF NOT EXISTS dob DATE;
+            -- Weights table for tracking baby weight over time
             CREATE TABLE IF NOT EXISTS weights (
                 id BIGSERIAL PRIMARY KEY,
                 baby_id INTEGER NOT NULL REFERENCES babies(id) ON DELETE CASCADE,
@@ -69,17 +204,16 @@ def init_db() -> None:
 
 
 def delete_entry(conn, baby_id: int, when: datetime) -> int:
-    ts = when.isoformat()
-    cur = conn.execute(Q("DELETE FROM entries WHERE baby_id = ? AND ts = ?;"), (baby_id, ts))
+    cur = conn.execute(SQL_DELETE_ENTRY, (baby_id, when), prepare=True)
     return cur.rowcount
 
 
 def delete_day(conn, baby_id: int, day: date) -> int:
-    start_dt = datetime.combine(day, time(0, 0))
-    end_dt = datetime.combine(day, time(23, 59, 59))
+    start_dt = datetime.combine(day, time(0, 0), tzinfo=LOCAL_TZ)
+    end_dt = datetime.combine(day, time(23, 59, 59), tzinfo=LOCAL_TZ)
     cur = conn.execute(
         Q("DELETE FROM entries WHERE baby_id = ? AND ts BETWEEN ? AND ?;"),
-        (baby_id, start_dt.isoformat(), end_dt.isoformat()),
+        (baby_id, start_dt, end_dt),
     )
     return cur.rowcount
 
@@ -90,29 +224,39 @@ def delete_all_for_baby(conn, baby_id: int) -> int:
 
 
 def delete_everything(conn) -> None:
-    conn.execute("DELETE FROM entries;")
-    conn.execute("DELETE FROM babies;")
+    with conn.transaction():
+        conn.execute("DELETE FROM entries;")
+        conn.execute("DELETE FROM babies;")
 
 def delete_baby(conn, baby_id: int) -> int:
     cur = conn.execute(Q("DELETE FROM babies WHERE id = ?;"), (baby_id,))
     return cur.rowcount
 
 
-def list_babies(conn) -> list[str]:
-    cur = conn.execute("SELECT name FROM babies ORDER BY name ASC;")
-    return [r[0] for r in cur.fetchall()]
+def list_baby_ids(conn) -> dict[str, tuple[int, date | None]]:
+    """Map each baby's name to its (id, dob), ordered by name."""
+    cur = client_execute(conn, "SELECT name, id, dob FROM babies ORDER BY name ASC;")
+    return {name: (baby_id, dob) for name, baby_id, dob in cur.fetchall()}
 
 
-def get_or_create_baby(conn, name: str) -> int:
+def add_baby(conn, name: str) -> tuple[bool, dict[str, tuple[int, date | None]]]:
+    """Insert a baby and re-list all babies in one pipelined round trip.
+
+    Returns whether the name was new, plus the refreshed name -> (id, dob) map.
+    """
     name = name.strip()
     if not name:
         raise ValueError("Baby name cannot be empty")
-    cur = conn.execute(Q("SELECT id FROM babies WHERE name = ?;"), (name,))
-    row = cur.fetchone()
-    if row:
-        return row[0]
-    cur = conn.execute(Q("INSERT INTO babies (name) VALUES (?) RETURNING id;"), (name,))
-    return cur.fetchone()[0]
+    with conn.pipeline():
+        ins = client_execute(conn, Q("INSERT INTO babies (name) VALUES (?) ON CONFLICT (name) DO NOTHING;"), (name,))
+        cur = client_execute(conn, "SELECT name, id, dob FROM babies ORDER BY name ASC;")
+    return ins.rowcount == 1, {name: (baby_id, dob) for name, baby_id, dob in cur.fetchall()}
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_baby_ids(_conn) -> dict[str, tuple[int, date | None]]:
+    """Baby name -> (id, dob), served from memory until a baby or DOB changes."""
+    return list_baby_ids(_conn)
 
 
 def upsert_entry(
@@ -123,50 +267,166 @@ def upsert_entry(
     pee: bool,
     poop: bool,
 ) -> None:
-    ts = when.isoformat()
-    conn.execute(
-        Q("""
-        INSERT INTO entries (baby_id, ts, milk, pee, poop)
-        VALUES (?, ?, ?, ?, ?)
-        ON CONFLICT(baby_id, ts) DO UPDATE SET
-            milk=excluded.milk,
-            pee=excluded.pee,
-            poop=excluded.poop;
-        """),
-        (baby_id, ts, int(milk), int(pee), int(poop)),
+    conn.execute(SQL_UPSERT_ENTRY, (baby_id, when, int(milk), int(pee), int(poop)), prepare=True)
+
+
+def _localize(when: datetime) -> datetime:
+    aware = local_datetime(when.date(), when.time())
+    if aware is None:
+        raise ValueError(f"{when.isoformat()} does not exist in {LOCAL_TZ.key} (DST gap)")
+    return aware
+
+
+def upsert_entries_bulk(
+    conn,
+    baby_id: int,
+    rows: list[tuple[datetime, bool, bool, bool]],
+) -> int:
+    """Upsert many (when, milk, pee, poop) rows in one round trip.
+
+    Small batches go through executemany, which psycopg pipelines; large ones
+    are COPYed into a staging table and merged with a single INSERT. Rows for
+    the same instant collapse to the last one given, whichever path runs.
+    """
+    # Naive times are local wall-clock times, as everywhere else; ones in the
+    # spring-forward gap are rejected rather than aliased an hour later.
+    localized = (
+        (when if when.tzinfo else _localize(when), milk, pee, poop)
+        for when, milk, pee, poop in rows
     )
+    # Aware datetimes hash by instant, so later duplicates replace earlier ones.
+    rows = list({
+        aware: (aware, int(milk), int(pee), int(poop))
+        for aware, milk, pee, poop in localized
+    }.values())
+    if len(rows) < BULK_COPY_MIN_ROWS:
+        with conn.transaction(), conn.cursor() as cur:
+            cur.executemany(SQL_UPSERT_ENTRY, [(baby_id, *row) for row in rows])
+            return cur.rowcount
+
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TEMP TABLE entries_staging (
+                ts TIMESTAMPTZ NOT NULL,
+                milk INTEGER NOT NULL,
+                pee  INTEGER NOT NULL,
+                poop INTEGER NOT NULL
+            ) ON COMMIT DROP;
+            """
+        )
+        with cur.copy("COPY entries_staging (ts, milk, pee, poop) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+        # Rows were deduplicated above, so no timestamp hits the same row twice
+        cur.execute(
+            Q("""
+            INSERT INTO entries (baby_id, ts, milk, pee, poop)
+            SELECT ?, ts, milk, pee, poop
+            FROM entries_staging
+            ON CONFLICT(baby_id, ts) DO UPDATE SET
+                milk=excluded.milk,
+                pee=excluded.pee,
+                poop=excluded.poop;
+            """),
+            (baby_id,),
+        )
+        count = cur.rowcount
+    # Refresh planner stats now rather than waiting for autovacuum, so the
+    # (baby_id, ts) index keeps being chosen for range fetches and deletes
+    conn.execute("ANALYZE entries;")
+    return count
+
+
+def _entries_frame(rows: list[tuple]) -> pd.DataFrame:
+    if not rows:
+        return pd.DataFrame(columns=["ts", "milk", "pee", "poop"])
+    # (epoch seconds, flags) pairs become one int64 array; every column is a
+    # vectorised view of it, assembled by a single constructor
+    ts, flags = np.array(rows, dtype=np.int64).T
+    ts = ts.astype("datetime64[s]")
+    flags = flags.astype(np.uint8)
+    return pd.DataFrame({
+        "ts": ts,
+        "milk": (flags & 1).astype(np.int8),
+        "pee": ((flags >> 1) & 1).astype(np.int8),
+        "poop": ((flags >> 2) & 1).astype(np.int8),
+        "date": ts.astype("datetime64[D]"),
+    })
 
 
 def fetch_entries(
-    conn: sqlite3.Connection,
+    conn,
     baby_id: int,
     start: datetime,
     end: datetime,
 ) -> pd.DataFrame:
-    # load all entries for baby, then filter by timestamp range in Python for correct inclusion
-    cur = conn.execute(
-        Q("""
-        SELECT e.ts, e.milk, e.pee, e.poop
-        FROM entries e
-        WHERE e.baby_id = ?
-        ORDER BY e.ts ASC;
-        """),
-        (baby_id,)
-    )
-    rows = cur.fetchall()
-    if not rows:
-        return pd.DataFrame(columns=["ts", "milk", "pee", "poop"])
-    df = pd.DataFrame(rows, columns=["ts", "milk", "pee", "poop"])
-    df["ts"] = pd.to_datetime(df["ts"])  # parse ISO timestamps
-    # apply start/end filter in Python to handle timezone-aware strings
-    df = df.loc[(df["ts"] >= start) & (df["ts"] <= end)]
-    df["date"] = df["ts"].dt.date
-    df["hour"] = df["ts"].dt.strftime("%I:%M %p")
-    return df
+    params = (LOCAL_TZ.key, baby_id, start, end)
+    if end - start > STREAM_ENTRIES_AFTER:
+        # Long custom ranges stream through a server-side cursor in chunks, so
+        # only one chunk of Python tuples is alive at a time.
+        frames = []
+        with conn.transaction(), conn.cursor("entries_stream", binary=True) as cur:
+            cur.itersize = STREAM_CHUNK_ROWS
+            cur.execute(SQL_FETCH_ENTRIES, params)
+            while rows := cur.fetchmany(STREAM_CHUNK_ROWS):
+                frames.append(_entries_frame(rows))
+        if not frames:
+            return _entries_frame([])
+        return pd.concat(frames, ignore_index=True)
+    return _entries_frame(_execute_fetch_entries(conn, params).fetchall())
+
+
+def _execute_fetch_entries(conn, params: tuple) -> psycopg.Cursor:
+    # Binary results skip text decoding
+    cur = conn.cursor(binary=True, row_factory=tuple_row)
+    return cur.execute(SQL_FETCH_ENTRIES, params, prepare=True)
+
+
+def _daily_frame(rows: list[tuple]) -> pd.DataFrame:
+    daily = pd.DataFrame.from_records(rows, columns=["date", "milk", "pee", "poop"])
+    daily = daily.melt(id_vars="date", var_name="event", value_name="count")
+    return daily[daily["count"] > 0]
+
+
+def fetch_daily_counts(
+    conn,
+    baby_id: int,
+    start: datetime,
+    end: datetime,
+) -> pd.DataFrame:
+    """Per-day event totals in long form: one row per (date, event) that occurred."""
+    cur = conn.execute(SQL_DAILY_COUNTS, (LOCAL_TZ.key, baby_id, start, end), prepare=True, binary=True)
+    return _daily_frame(cur.fetchall())
 
 
-def timeframe_to_range(option: str, custom_range: tuple[date, date] | None) -> tuple[datetime, datetime]:
-    today = datetime.now(LOCAL_TZ).date()
+@st.cache_data(ttl=60, show_spinner=False)
+def cached_history(
+    _conn,
+    baby_id: int,
+    start: datetime,
+    end: datetime,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Entries and daily totals for a range, served from memory until entries change."""
+    if end - start > STREAM_ENTRIES_AFTER:
+        # fetch_entries streams through a server-side cursor, which pipeline
+        # mode does not support
+        return fetch_entries(_conn, baby_id, start, end), fetch_daily_counts(_conn, baby_id, start, end)
+    # Queue both queries before fetching either: a fetch inside the pipeline
+    # would flush and wait, costing a round trip per query.
+    params = (LOCAL_TZ.key, baby_id, start, end)
+    with _conn.pipeline():
+        cur_daily = _conn.execute(SQL_DAILY_COUNTS, params, prepare=True, binary=True)
+        cur_entries = _execute_fetch_entries(_conn, params)
+    return _entries_frame(cur_entries.fetchall()), _daily_frame(cur_daily.fetchall())
+
+
+@lru_cache(maxsize=16)
+def timeframe_to_range(
+    option: str,
+    custom_range: tuple[date, date] | None,
+    today: date,
+) -> tuple[datetime, datetime]:
     if option == "Today":
         start_d = today
         end_d = today
@@ -185,79 +445,307 @@ def timeframe_to_range(option: str, custom_range: tuple[date, date] | None) -> t
             end_d = today
         else:
             start_d, end_d = custom_range
-    start_dt = datetime.combine(start_d, time(0, 0))
-    end_dt = datetime.combine(end_d, time(23, 59, 59))
+    start_dt = datetime.combine(start_d, time(0, 0), tzinfo=LOCAL_TZ)
+    end_dt = datetime.combine(end_d, time(23, 59, 59), tzinfo=LOCAL_TZ)
     return start_dt, end_dt
 
 
-def render_charts(df: pd.DataFrame) -> None:
+# Vega-Lite specs for the history and weight charts, built once at import. Data is passed
+# separately to st.vega_lite_chart, so reruns skip Altair's schema building.
+DAILY_SPEC = {
+    "mark": {"type": "bar"},
+    "encoding": {
+        "x": {"field": "date", "type": "temporal", "title": "Date"},
+        "y": {"field": "count", "type": "quantitative", "title": "Count"},
+        "color": {"field": "event", "type": "nominal", "title": "Event"},
+        "tooltip": [
+            {"field": "date", "type": "temporal"},
+            {"field": "event", "type": "nominal"},
+            {"field": "count", "type": "quantitative", "title": "Count"},
+        ],
+    },
+    "height": 220,
+}
+
+SCATTER_SPEC = {
+    "facet": {"row": {"field": "date", "type": "temporal", "title": "Date"}},
+    "spec": {
+        "mark": {"type": "point", "size": 60},
+        "encoding": {
+            "x": {
+                "field": "ts",
+                "type": "temporal",
+                "title": "Timestamp",
+                "axis": {"format": "%I:%M %p", "labelAngle": -45, "labelOverlap": True},
+                "scale": {"nice": "hour"},
+            },
+            "y": {"field": "event", "type": "nominal", "sort": ["Milk", "Poop", "Pee"], "title": "Event"},
+            "color": {"field": "event", "type": "nominal", "title": "Event"},
+            "tooltip": [
+                {"field": "ts", "type": "temporal"},
+                {"field": "event", "type": "nominal"},
+            ],
+        },
+    },
+    "resolve": {"scale": {"x": "independent", "y": "shared"}},
+}
+
+WEIGHT_SPEC = {
+    "mark": {"type": "line", "point": True},
+    "encoding": {
+        "x": {"field": "date", "type": "temporal", "title": "Date"},
+        "y": {"field": "weight", "type": "quantitative", "title": "Weight"},
+        "tooltip": [
+            {"field": "date", "type": "temporal", "title": "Date"},
+            {"field": "weight", "type": "quantitative", "title": "Weight"},
+        ],
+    },
+}
+
+EVENTS = ("milk", "pee", "poop")
+
+# Beyond this many points the faceted scatter stalls the browser
+SCATTER_MAX_POINTS = 2000
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def build_chart_data(df: pd.DataFrame) -> tuple[pd.DataFrame, int, pd.DataFrame]:
+    """Scatter rows, total event count and average intervals for an entries frame.
+
+    Keyed on the frame's contents, so reruns that leave the history unchanged
+    skip the reshaping and groupbys entirely.
+    """
+    # One row per event that occurred, built from the set flags only rather
+    # than melting every row and throwing most of them away
+    df_long = pd.concat(
+        [df.loc[df[event] == 1, ["ts", "date"]].assign(event=event) for event in EVENTS],
+        ignore_index=True,
+    )
+    df_long["event"] = pd.Categorical(df_long["event"], categories=EVENTS)
+
+    scatter = df_long
+    if len(df_long) > SCATTER_MAX_POINTS:
+        # Keep the most recent events; rows are grouped by event, not time
+        scatter = df_long.nlargest(SCATTER_MAX_POINTS, "ts")
+
+    # Rows are already in timestamp order within each event (fetch_entries
+    # sorts by ts and the filters keep that order), so no per-group sort is needed.
+    deltas = df_long.groupby("event", observed=True)["ts"].diff()
+    avg = deltas.groupby(df_long["event"], observed=True).mean()
+    avg_df = pd.DataFrame({
+        "Event": avg.index.astype(str).str.title(),
+        "Avg Interval": avg.astype(str).where(avg.notna(), "N/A"),
+    }).reset_index(drop=True)
+    return scatter, len(df_long), avg_df
+
+
+def render_charts(df: pd.DataFrame, daily: pd.DataFrame) -> None:
     if df.empty:
         st.info("No entries for the selected range yet.")
         return
 
-    # Aggregate per day and per event
-    df_long = df.melt(id_vars=["ts", "date", "hour"], value_vars=["milk", "pee", "poop"],
-                      var_name="event", value_name="value")
-    df_long = df_long[df_long["value"] == 1]
-
-    # Daily totals per event (stacked bar chart)
-    daily_chart = (
-        alt.Chart(df_long)
-        .transform_aggregate(
-            count="count()",
-            groupby=["date", "event"],
-        )
-        .mark_bar()
-        .encode(
-            x=alt.X("date:T", title="Date"),
-            y=alt.Y("count:Q", title="Count"),
-            color=alt.Color("event:N", title="Event"),
-            tooltip=["date:T", "event:N", alt.Tooltip("count:Q", title="Count")],
-        )
-        .properties(height=220)
-    )
+    scatter, total_events, avg_df = build_chart_data(df)
+
+    # Daily totals per event (stacked bar chart), pre-aggregated in SQL
     st.subheader("Daily totals per event (stacked)")
-    st.altair_chart(daily_chart, use_container_width=True)
+    st.vega_lite_chart(daily, DAILY_SPEC, use_container_width=True)
 
     # Scatter plot of events over time, faceted by day
-    scatter = (
-        alt.Chart(df_long)
-        .mark_point(size=60)
-        .encode(
-            x=alt.X(
-                "ts:T",
-                title="Timestamp",
-                axis=alt.Axis(format="%I:%M %p", labelAngle=-45, labelOverlap=True),
-                scale=alt.Scale(nice="hour"),
-            ),
-            y=alt.Y("event:N", sort=["Milk", "Poop", "Pee"], title="Event"),
-            color=alt.Color("event:N", title="Event"),
-            tooltip=["ts:T", "event:N"],
-        )
-        .facet(row=alt.Row("date:T", title="Date"))
-        .resolve_scale(x="independent", y="shared")
-    )
     st.subheader("Event scatter plots by day")
-    st.altair_chart(scatter, use_container_width=True)
+    if total_events > len(scatter):
+        st.caption(
+            f"Showing the latest {SCATTER_MAX_POINTS} of {total_events} events; "
+            "pick a shorter timeframe to see them all."
+        )
+    st.vega_lite_chart(scatter, SCATTER_SPEC, use_container_width=True)
 
-    # Compute average interval between events
+    # Average interval between events
     st.subheader("Average interval between events")
-    avg_list = []
-    for event, group in df_long.groupby("event"):
-        times = group["ts"].sort_values()
-        if len(times) >= 2:
-            avg_delta = times.diff().mean()
-            avg_list.append({"Event": event.title(), "Avg Interval": avg_delta})
-        else:
-            avg_list.append({"Event": event.title(), "Avg Interval": pd.NaT})
-    avg_df = pd.DataFrame(avg_list)
-    # Format intervals as strings
-    avg_df["Avg Interval"] = avg_df["Avg Interval"].apply(
-        lambda td: str(td) if pd.notnull(td) else "N/A"
-    )
     st.table(avg_df)
 
 
+@st.fragment
+def entry_section(baby_id: int, baby_name: str, dob: date, local_today: date) -> None:
+    """Entry form and delete controls; their widgets rerun only this fragment."""
+    with get_conn() as conn:
+        # Entry form
+        st.subheader("Add or update an hourly entry")
+        # Show the outcome of a save or delete from before the app rerun
+        notice = st.session_state.pop("entry_notice", None)
+        if notice:
+            kind, message = notice
+            (st.success if kind == "success" else st.warning)(message)
+        col1, col2, col3, col4 = st.columns([2, 2, 2, 3])
+        with col1:
+            entry_date = st.date_input("Date", value=local_today)
+        with col2:
+            selected_slot = st.selectbox("Time", options=range(len(TIME_SLOTS)), format_func=TIME_SLOTS_FMT.__getitem__)
+        selected_time = TIME_SLOTS[selected_slot]
+
+        # Pre-fill checkboxes with existing entry data if present
+        entry_when = local_datetime(entry_date, selected_time)
+        if entry_when is None:
+            st.warning(
+                f"{TIME_SLOTS_FMT[selected_slot]} is skipped on {entry_date.isoformat()} "
+                "when clocks spring forward; pick another time."
+            )
+            row = None
+        else:
+            cur = client_execute(
+                conn,
+                Q("""
+                SELECT milk, pee, poop
+                FROM entries
+                WHERE baby_id = ? AND ts = ?;
+                """),
+                (baby_id, entry_when),
+            )
+            row = cur.fetchone()
+        if row:
+            default_milk, default_pee, default_poop = bool(row[0]), bool(row[1]), bool(row[2])
+            # Warn user that existing data will be overwritten
+            st.warning(
+                f"Existing entry on {entry_when.strftime('%Y-%m-%d %I:%M %p')} detected; saving will overwrite it."
+            )
+        else:
+            default_milk, default_pee, default_poop = False, False, False
+
+        with col3:
+            milk = st.checkbox("Milk 🍼", value=default_milk)
+        with col4:
+            pee = st.checkbox("#1 💧", value=default_pee)
+            poop = st.checkbox("#2 💩", value=default_poop)
+
+        if st.button("Save entry", type="primary", disabled=entry_when is None):
+            upsert_entry(conn, baby_id, entry_when, milk, pee, poop)
+            cached_history.clear()
+            st.session_state["entry_notice"] = (
+                "success", f"Saved {baby_name}'s entry for {entry_when.strftime('%Y-%m-%d %I:%M %p')}"
+            )
+            # History lives outside this fragment; rerun the whole app to refresh it
+            st.rerun()
+
+        with st.expander("Manage data (delete)"):
+            # Require correct DOB before allowing deletions
+            confirm_del_dob = st.date_input("Confirm baby's date of birth to delete", value=dob, key="confirm_del_dob")
+            c1, c2, c3 = st.columns([2, 2, 3])
+            with c1:
+                del_slot = st.selectbox(
+                    "Time to delete",
+                    options=range(len(TIME_SLOTS)),
+                    format_func=TIME_SLOTS_FMT.__getitem__,
+                    key="del_hour",
+                )
+                del_time = TIME_SLOTS[del_slot]
+                del_when = local_datetime(entry_date, del_time)
+                if del_when is None:
+                    st.caption("That time is skipped on this date when clocks spring forward.")
+                if st.button("Delete this time", key="btn_del_hour", disabled=del_when is None):
+                    if confirm_del_dob != dob:
+                        st.error("Date of birth does not match; delete aborted.")
+                    else:
+                        count = delete_entry(conn, baby_id, del_when)
+                        cached_history.clear()
+                        st.session_state["entry_notice"] = (
+                            "warning", f"Deleted {count} entry for {del_when.strftime('%Y-%m-%d %I:%M %p')}"
+                        )
+                        st.rerun()
+
+
+@st.fragment
+def history_section(baby_id: int, existing_dob: date | None, local_today: date) -> None:
+    """Metrics, raw entries and charts; changing the timeframe reruns only this fragment."""
+    with get_conn() as conn:
+        # History and charts
+        st.subheader("History & insights")
+
+        # Quick overview of most recent events; the metrics are filled in
+        # once the history queries below have returned.
+        cols_last = st.columns(3)
+        timeframe = st.selectbox(
+            "Timeframe",
+            TIMEFRAME_OPTIONS,
+            index=0,
+        )
+
+        custom_range = None
+        if timeframe == "Custom":
+            custom_range = st.date_input(
+                "Pick date range",
+                value=(local_today - timedelta(days=6), local_today),
+            )
+            if isinstance(custom_range, date):
+                custom_range = (custom_range, custom_range)
+
+        start_dt, end_dt = timeframe_to_range(timeframe, custom_range, local_today)
+
+        # Send the independent overview reads in one pipelined round trip
+        with conn.pipeline():
+            cur_last = client_execute(
+                conn,
+                Q("""
+                SELECT
+                    MAX(ts) FILTER (WHERE milk = 1) AS last_milk,
+                    MAX(ts) FILTER (WHERE pee  = 1) AS last_pee,
+                    MAX(ts) FILTER (WHERE poop = 1) AS last_poop
+                FROM entries
+                WHERE baby_id = %s;
+                """),
+                (baby_id,),
+            )
+            cur_weights = conn.execute(
+                # Cast to timestamp so pandas receives datetimes, not date objects
+                Q("SELECT date::timestamp, weight FROM weights WHERE baby_id = %s ORDER BY date ASC;"),
+                (baby_id,),
+                binary=True,
+            )
+        last_milk_ts, last_pee_ts, last_poop_ts = cur_last.fetchone()
+        w_rows = cur_weights.fetchall()
+        df, daily = cached_history(conn, baby_id, start_dt, end_dt)
+
+        for label, last_ts, col in [
+            ("Milk", last_milk_ts, cols_last[0]),
+            ("#1", last_pee_ts, cols_last[1]),
+            ("#2", last_poop_ts, cols_last[2]),
+        ]:
+            if last_ts:
+                ts = last_ts.astimezone(LOCAL_TZ)
+                col.metric(f"Last {label}", ts.strftime("%Y-%m-%d %I:%M %p"))
+            else:
+                col.metric(f"Last {label}", "None")
+
+        # Day of life metric
+        if existing_dob:
+            day_of_life = (local_today - existing_dob).days + 1
+            st.metric("Day of life", day_of_life)
+        # Show quick metrics
+        if not df.empty:
+            # Totals come from the SQL per-day sums: a few rows per day to add
+            # up rather than every entry in the range
+            totals = daily.groupby("event")["count"].sum()
+            total_milk, total_pee, total_poop = (int(totals.get(event, 0)) for event in EVENTS)
+            m1, m2, m3 = st.columns(3)
+            m1.metric("Milk", total_milk)
+            m2.metric("#1", total_pee)
+            m3.metric("#2", total_poop)
+
+        with st.expander("Show raw entries"):
+            st.dataframe(
+                # fetch_entries returns rows in ts order, so reversing is enough
+                df.iloc[::-1],
+                use_container_width=True,
+                column_config={"date": st.column_config.DateColumn("date")},
+            )
+
+        render_charts(df, daily)
+
+        # Weight trend chart
+        if w_rows:
+            w_df = pd.DataFrame.from_records(w_rows, columns=["date", "weight"])
+            st.subheader("Weight over time")
+            st.vega_lite_chart(w_df, WEIGHT_SPEC, use_container_width=True)
+
+
 def main() -> None:
     st.set_page_config(page_title="BabyData", page_icon="🍼", layout="wide")
     # DataFrame serialization uses Arrow by default in modern Streamlit
@@ -268,125 +756,63 @@ def main() -> None:
 
     init_db()
 
-    # Sidebar: choose or add baby
-    st.sidebar.header("Baby")
     with get_conn() as conn:
-        existing = list_babies(conn)
-
-    mode = st.sidebar.radio("Select mode", ["Select existing", "Add new"], horizontal=True)
-    if mode == "Select existing" and existing:
-        baby_name = st.sidebar.selectbox("Choose a baby", existing)
-    elif mode == "Select existing" and not existing:
-        st.sidebar.info("No babies yet. Add one below.")
-        baby_name = ""
-    else:
-        baby_name = st.sidebar.text_input("New baby name", value="")
-        if st.sidebar.button("Add baby", use_container_width=True) and baby_name.strip():
-            with get_conn() as conn:
-                try:
-                    _ = get_or_create_baby(conn, baby_name)
-                    conn.commit()
+        # Sidebar: choose or add baby
+        st.sidebar.header("Baby")
+        babies = cached_baby_ids(conn)
+        existing = list(babies)
+
+        mode = st.sidebar.radio("Select mode", ["Select existing", "Add new"], horizontal=True)
+        if mode == "Select existing" and existing:
+            baby_name = st.sidebar.selectbox("Choose a baby", existing)
+        elif mode == "Select existing" and not existing:
+            st.sidebar.info("No babies yet. Add one below.")
+            baby_name = ""
+        else:
+            baby_name = st.sidebar.text_input("New baby name", value="")
+            if st.sidebar.button("Add baby", use_container_width=True) and baby_name.strip():
+                added, babies = add_baby(conn, baby_name)
+                existing = list(babies)
+                cached_baby_ids.clear()
+                if added:
                     st.sidebar.success(f"Added baby '{baby_name}'.")
-                except sqlite3.IntegrityError:
+                else:
                     st.sidebar.warning("Baby already exists.")
 
-            with get_conn() as conn:
-                existing = list_babies(conn)
-
-    if not baby_name:
-        st.info("Select or add a baby to begin logging.")
-        return
-
-    with get_conn() as conn:
-        baby_id = get_or_create_baby(conn, baby_name)
-        conn.commit()
-
-    # Date of birth input and persistence
-    with get_conn() as conn:
-        cur = conn.execute(Q("SELECT dob FROM babies WHERE id = %s;"), (baby_id,))
-        existing_dob = cur.fetchone()[0]
-    dob_default = existing_dob or local_today
-    dob = st.sidebar.date_input("Date of birth", value=dob_default)
-    if dob != existing_dob and st.sidebar.button("Save DOB", key="save_dob"):
-        with get_conn() as conn:
+        if not baby_name:
+            st.info("Select or add a baby to begin logging.")
+            return
+
+        # Babies resolve from the cached map; a typed name is only created
+        # once "Add baby" is pressed
+        known = babies.get(baby_name.strip())
+        if known is None:
+            st.info("Press \"Add baby\" to start logging for this name.")
+            return
+        baby_id, existing_dob = known
+
+        # Date of birth input and persistence
+        dob_default = existing_dob or local_today
+        dob = st.sidebar.date_input("Date of birth", value=dob_default)
+        if dob != existing_dob and st.sidebar.button("Save DOB", key="save_dob"):
             conn.execute(Q("UPDATE babies SET dob = %s WHERE id = %s;"), (dob.isoformat(), baby_id))
-            conn.commit()
-        st.sidebar.success("Saved date of birth.")
-
-    # Entry form
-    st.subheader("Add or update an hourly entry")
-    time_slots = [time(h, m) for h in range(24) for m in (0, 30)]
-    col1, col2, col3, col4 = st.columns([2, 2, 2, 3])
-    with col1:
-        entry_date = st.date_input("Date", value=local_today)
-    with col2:
-        selected_time = st.selectbox("Time", options=time_slots, format_func=lambda t: t.strftime("%I:%M %p"))
-
-    # Pre-fill checkboxes with existing entry data if present
-    entry_when = datetime.combine(entry_date, selected_time)
-    with get_conn() as conn:
-        cur = conn.execute(
-            Q("""
-            SELECT milk, pee, poop
-            FROM entries
-            WHERE baby_id = ? AND ts = ?;
-            """),
-            (baby_id, entry_when.isoformat()),
-        )
-        row = cur.fetchone()
-    if row:
-        default_milk, default_pee, default_poop = bool(row[0]), bool(row[1]), bool(row[2])
-        # Warn user that existing data will be overwritten
-        st.warning(
-            f"Existing entry on {entry_when.strftime('%Y-%m-%d %I:%M %p')} detected; saving will overwrite it."
-        )
-    else:
-        default_milk, default_pee, default_poop = False, False, False
-
-    with col3:
-        milk = st.checkbox("Milk 🍼", value=default_milk)
-    with col4:
-        pee = st.checkbox("#1 💧", value=default_pee)
-        poop = st.checkbox("#2 💩", value=default_poop)
-
-    when = datetime.combine(entry_date, selected_time)
-    if st.button("Save entry", type="primary"):
-        with get_conn() as conn:
-            upsert_entry(conn, baby_id, when, milk, pee, poop)
-            conn.commit()
-        st.success(f"Saved {baby_name}'s entry for {when.strftime('%Y-%m-%d %I:%M %p')}")
-
-    with st.expander("Manage data (delete)"):
-        # Require correct DOB before allowing deletions
-        confirm_del_dob = st.date_input("Confirm baby's date of birth to delete", value=dob, key="confirm_del_dob")
-        c1, c2, c3 = st.columns([2, 2, 3])
-        with c1:
-            del_time = st.selectbox(
-                "Time to delete",
-                options=time_slots,
-                format_func=lambda t: t.strftime("%I:%M %p"),
-                key="del_hour",
-            )
-            del_when = datetime.combine(entry_date, del_time)
-            if st.button("Delete this time", key="btn_del_hour"):
-                if confirm_del_dob != dob:
-                    st.error("Date of birth does not match; delete aborted.")
-                else:
-                    with get_conn() as conn:
-                        count = delete_entry(conn, baby_id, del_when)
-                        conn.commit()
-                    st.warning(f"Deleted {count} entry for {del_when.strftime('%Y-%m-%d %I:%M %p')}")
-
-    st.divider()
-
-    # Weight tracking
-    with st.expander("Track weight"):
-        wt_date = st.date_input("Weight date", value=local_today, key="weight_date")
-        weight_lbs = st.number_input("Pounds", min_value=0, step=1, format="%d", key="weight_lbs")
-        weight_oz = st.number_input("Ounces", min_value=0, max_value=15, step=1, format="%d", key="weight_oz")
-        if st.button("Save weight", key="save_weight"):
-            total_weight = weight_lbs + weight_oz / 16
-            with get_conn() as conn:
+            cached_baby_ids.clear()
+            existing_dob = dob
+            st.sidebar.success("Saved date of birth.")
+
+        # The fragments below reuse this connection on a full rerun and
+        # check out their own when they rerun alone.
+        entry_section(baby_id, baby_name, dob, local_today)
+
+        st.divider()
+
+        # Weight tracking
+        with st.expander("Track weight"):
+            wt_date = st.date_input("Weight date", value=local_today, key="weight_date")
+            weight_lbs = st.number_input("Pounds", min_value=0, step=1, format="%d", key="weight_lbs")
+            weight_oz = st.number_input("Ounces", min_value=0, max_value=15, step=1, format="%d", key="weight_oz")
+            if st.button("Save weight", key="save_weight"):
+                total_weight = weight_lbs + weight_oz / 16
                 conn.execute(
                     Q("""
                     INSERT INTO weights (baby_id, date, weight)
@@ -395,101 +821,9 @@ def main() -> None:
                     """),
                     (baby_id, wt_date.isoformat(), total_weight),
                 )
-                conn.commit()
-            st.success(f"Saved weight for {wt_date.isoformat()}: {weight_lbs} lb {weight_oz} oz")
-
-    # History and charts
-    st.subheader("History & insights")
-    # Compute local today for default date inputs
-    local_today = datetime.now(LOCAL_TZ).date()
+                st.success(f"Saved weight for {wt_date.isoformat()}: {weight_lbs} lb {weight_oz} oz")
 
-    # Quick overview of most recent events
-    with get_conn() as conn:
-        cur = conn.execute(
-            Q("""
-            SELECT
-                MAX(ts) FILTER (WHERE milk = 1) AS last_milk,
-                MAX(ts) FILTER (WHERE pee  = 1) AS last_pee,
-                MAX(ts) FILTER (WHERE poop = 1) AS last_poop
-            FROM entries
-            WHERE baby_id = %s;
-            """),
-            (baby_id,),
-        )
-        last_milk_ts, last_pee_ts, last_poop_ts = cur.fetchone()
-    cols_last = st.columns(3)
-    for label, ts_str, col in [
-        ("Milk", last_milk_ts, cols_last[0]),
-        ("#1", last_pee_ts, cols_last[1]),
-        ("#2", last_poop_ts, cols_last[2]),
-    ]:
-        if ts_str:
-            ts = datetime.fromisoformat(ts_str)
-            col.metric(f"Last {label}", ts.strftime("%Y-%m-%d %I:%M %p"))
-        else:
-            col.metric(f"Last {label}", "None")
-    timeframe = st.selectbox(
-        "Timeframe",
-        ["Today", "Last 3 days", "Last 7 days", "Last 30 days", "Custom"],
-        index=0,
-    )
-
-    custom_range = None
-    if timeframe == "Custom":
-        custom_range = st.date_input(
-            "Pick date range",
-            value=(local_today - timedelta(days=6), local_today),
-        )
-        if isinstance(custom_range, date):
-            custom_range = (custom_range, custom_range)
-
-    start_dt, end_dt = timeframe_to_range(timeframe, custom_range)
-
-    with get_conn() as conn:
-        df = fetch_entries(conn, baby_id, start_dt, end_dt)
-
-    # Day of life metric
-    with get_conn() as conn:
-        cur = conn.execute(Q("SELECT dob FROM babies WHERE id = %s;"), (baby_id,))
-        dob_val = cur.fetchone()[0]
-    if dob_val:
-        day_of_life = (local_today - dob_val).days + 1
-        st.metric("Day of life", day_of_life)
-    # Show quick metrics
-    if not df.empty:
-        total_milk = int(df["milk"].sum())
-        total_pee = int(df["pee"].sum())
-        total_poop = int(df["poop"].sum())
-        m1, m2, m3 = st.columns(3)
-        m1.metric("Milk", total_milk)
-        m2.metric("#1", total_pee)
-        m3.metric("#2", total_poop)
-
-    with st.expander("Show raw entries"):
-        st.dataframe(df.sort_values("ts", ascending=False), use_container_width=True)
-
-    render_charts(df)
-
-    # Weight trend chart
-    with get_conn() as conn:
-        w_rows = conn.execute(
-            Q("SELECT date, weight FROM weights WHERE baby_id = %s ORDER BY date ASC;"),
-            (baby_id,),
-        ).fetchall()
-    if w_rows:
-        w_df = pd.DataFrame(w_rows, columns=["date", "weight"])
-        w_df["date"] = pd.to_datetime(w_df["date"])  # parse dates
-        weight_chart = (
-            alt.Chart(w_df)
-            .mark_line(point=True)
-            .encode(
-                x=alt.X("date:T", title="Date"),
-                y=alt.Y("weight:Q", title="Weight"),
-                tooltip=[alt.Tooltip("date:T", title="Date"), alt.Tooltip("weight:Q", title="Weight")],
-            )
-        )
-        st.subheader("Weight over time")
-        st.altair_chart(weight_chart, use_container_width=True)
+        history_section(baby_id, existing_dob, local_today)
 
 
 if __name__ == "__main__":